@@ -1,7 +1,12 @@
 import os
+import re
+import time
+import altair as alt
 import pandas as pd
+import pyarrow as pa
 import streamlit as st
 from pymongo import MongoClient
+from pymongo.errors import OperationFailure, PyMongoError
 import plotly.express as px
 import plotly.graph_objects as go
 
@@ -47,10 +52,35 @@ def get_db():
         st.error(f"❌ Database connection failed: {str(e)}")
         return None
 
+INDEXES = [
+    ("movies", [("year", 1), ("imdb.rating", 1)]),
+    ("movies", [("genres", 1)]),
+    ("comments", [("movie_id", 1)])
+]
+
+@st.cache_resource
+def ensure_indexes(db_name):
+    """Create the indexes used by the filter and comment queries"""
+    db = get_db()
+    created = True
+    for collection, keys in INDEXES:
+        try:
+            db[collection].create_index(keys)
+        except OperationFailure:
+            # Permanent (e.g. read-only user or conflicting options); queries still work
+            created = False
+    return created
+
 db = get_db()
 if db is None:
     st.stop()
 
+try:
+    ensure_indexes(DB_NAME)
+except PyMongoError:
+    # Transient errors are not cached, so the next rerun retries
+    pass
+
 #st.success(f"✅ Connected to MongoDB: {DB_NAME}")
 
 # ==============================
@@ -58,11 +88,22 @@ if db is None:
 # ==============================
 st.subheader("📈 Key Performance Indicators (KPIs)")
 
-# Calculate metrics
-try:
-    movies_count = db.movies.count_documents({})
-    users_count = db.users.count_documents({}) if "users" in db.list_collection_names() else 0
-    comments_count = db.comments.count_documents({}) if "comments" in db.list_collection_names() else 0
+def estimated_count(collection):
+    """Return the metadata document count, or 0 if the collection is unavailable"""
+    try:
+        return collection.estimated_document_count()
+    except OperationFailure:
+        return 0
+
+@st.cache_data(ttl=300, show_spinner=False)
+def compute_kpis(db_name):
+    """Compute and cache the headline KPI values"""
+    db = get_db()
+    
+    # Unfiltered totals come straight from collection metadata
+    movies_count = estimated_count(db.movies)
+    users_count = estimated_count(db.users)
+    comments_count = estimated_count(db.comments)
     
     # Get average rating
     rating_data = list(db.movies.aggregate([
@@ -71,6 +112,11 @@ try:
     ]))
     avg_rating = rating_data[0]["avgRating"] if rating_data else 0
     
+    return movies_count, users_count, comments_count, avg_rating
+
+# Calculate metrics
+try:
+    movies_count, users_count, comments_count, avg_rating = compute_kpis(DB_NAME)
 except Exception as e:
     st.error(f"Error calculating metrics: {e}")
     movies_count = users_count = comments_count = avg_rating = 0
@@ -91,16 +137,58 @@ st.divider()
 # ==============================
 # ⚙️ Sidebar Filters
 # ==============================
+@st.cache_data(ttl=300, show_spinner=False)
+def fetch_year_stats(db_name):
+    """Fetch and cache the min/max release year"""
+    db = get_db()
+    return list(db.movies.aggregate([
+        {"$match": {"year": {"$type": "number"}}},
+        {"$group": {"_id": None, "minYear": {"$min": "$year"}, "maxYear": {"$max": "$year"}}}
+    ]))
+
+@st.cache_resource(max_entries=1)
+def refresh_genre_stats(db_name, hour_key):
+    """Rebuild the genre_stats materialized view at most once per hour_key"""
+    db = get_db()
+    try:
+        db.movies.aggregate([
+            {"$unwind": "$genres"},
+            {"$group": {"_id": "$genres", "count": {"$sum": 1}}},
+            # $out replaces the whole collection, so vanished genres are dropped too
+            {"$out": "genre_stats"}
+        ])
+    except OperationFailure:
+        # No write access for $out; cache the failure for the rest of the hour
+        return False
+    return True
+
+@st.cache_data(ttl=300, show_spinner=False)
+def fetch_genres_data(db_name):
+    """Fetch and cache the most common genres from the genre_stats view"""
+    db = get_db()
+    try:
+        refreshed = refresh_genre_stats(db_name, time.strftime("%Y-%m-%d %H"))
+    except PyMongoError:
+        # Transient errors are not cached; fall back for this run only
+        refreshed = False
+    
+    if refreshed:
+        return list(db.genre_stats.find().sort("count", -1).limit(50))
+    
+    return list(db.movies.aggregate([
+        {"$unwind": "$genres"},
+        {"$group": {"_id": "$genres", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1}},
+        {"$limit": 50}
+    ]))
+
 with st.sidebar:
     st.header("🔍 Filters & Controls")
     st.write("Customize your analysis below:")
     
     # Year range filter
     try:
-        year_stats = list(db.movies.aggregate([
-            {"$match": {"year": {"$type": "number"}}},
-            {"$group": {"_id": None, "minYear": {"$min": "$year"}, "maxYear": {"$max": "$year"}}}
-        ]))
+        year_stats = fetch_year_stats(DB_NAME)
         min_year = int(year_stats[0]["minYear"]) if year_stats else 1900
         max_year = int(year_stats[0]["maxYear"]) if year_stats else 2025
     except:
@@ -116,12 +204,7 @@ with st.sidebar:
     
     # Genre filter
     try:
-        genres_data = list(db.movies.aggregate([
-            {"$unwind": "$genres"},
-            {"$group": {"_id": "$genres", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}},
-            {"$limit": 50}
-        ]))
+        genres_data = fetch_genres_data(DB_NAME)
         genre_list = [g["_id"] for g in genres_data if g.get("_id")]
     except:
         genre_list = []
@@ -141,51 +224,145 @@ with st.sidebar:
         step=0.5
     )
 
-# Build match stage for filters
-match_stage = {
-    "year": {"$gte": year_range[0], "$lte": year_range[1]},
-    "imdb.rating": {"$gte": rating_filter, "$type": "number"}
-}
+def build_match_stage(year_range, selected_genres, rating_filter):
+    """Build the $match stage shared by all filter-dependent queries"""
+    match_stage = {
+        "year": {"$gte": year_range[0], "$lte": year_range[1]},
+        "imdb.rating": {"$gte": rating_filter, "$type": "number"}
+    }
+    
+    if selected_genres:
+        match_stage["genres"] = {"$in": list(selected_genres)}
+    
+    return match_stage
+
+# Narrow dtypes keep the chart payloads (Plotly trend, Altair genre bars) small
+YEAR_STATS_SCHEMA = pa.schema([
+    ("_id", pa.int16()),
+    ("avgRating", pa.float32()),
+    ("movieCount", pa.int32())
+])
 
-if selected_genres:
-    match_stage["genres"] = {"$in": selected_genres}
+GENRE_STATS_SCHEMA = pa.schema([
+    ("_id", pa.string()),
+    ("avgRating", pa.float32()),
+    ("movieCount", pa.int32())
+])
+
+def to_arrow_frame(rows, schema):
+    """Build an Arrow-backed DataFrame from aggregation rows with a fixed schema"""
+    table = pa.Table.from_pylist(rows, schema=schema)
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+@st.cache_data(ttl=600, show_spinner=False)
+def fetch_filtered_stats(year_range, selected_genres, rating_filter):
+    """Run the trend and genre aggregations in one $facet pass"""
+    db = get_db()
+    pipeline = [
+        {"$match": build_match_stage(year_range, selected_genres, rating_filter)},
+        {"$facet": {
+            "by_year": [
+                {"$group": {
+                    "_id": "$year",
+                    "avgRating": {"$avg": "$imdb.rating"},
+                    "movieCount": {"$sum": 1}
+                }},
+                {"$sort": {"_id": 1}}
+            ],
+            "by_genre": [
+                {"$unwind": "$genres"},
+                {"$group": {
+                    "_id": "$genres",
+                    "avgRating": {"$avg": "$imdb.rating"},
+                    "movieCount": {"$sum": 1}
+                }},
+                {"$match": {"_id": {"$ne": None}}},
+                {"$sort": {"movieCount": -1}}
+            ]
+        }}
+    ]
+    
+    result = next(db.movies.aggregate(pipeline, allowDiskUse=True))
+    return (
+        to_arrow_frame(result["by_year"], YEAR_STATS_SCHEMA),
+        to_arrow_frame(result["by_genre"], GENRE_STATS_SCHEMA)
+    )
+
+@st.cache_data(ttl=600, show_spinner=False)
+def fetch_discussed(year_range, selected_genres, rating_filter):
+    """Rank the filtered movies by comment count using the comments.movie_id index"""
+    db = get_db()
+    pipeline = [
+        {"$match": build_match_stage(year_range, selected_genres, rating_filter)},
+        # Count each movie's comments without materializing them
+        {"$lookup": {
+            "from": "comments",
+            "localField": "_id",
+            "foreignField": "movie_id",
+            "pipeline": [{"$count": "n"}],
+            "as": "comment_stats"
+        }},
+        {"$addFields": {"comment_count": {"$ifNull": [{"$first": "$comment_stats.n"}, 0]}}},
+        {"$sort": {"comment_count": -1}},
+        {"$limit": 15},
+        {"$project": {
+            "title": 1,
+            "year": 1,
+            "imdb.rating": 1,
+            "comment_count": 1,
+            "genres": 1
+        }}
+    ]
+    
+    return pd.DataFrame(list(db.movies.aggregate(pipeline, allowDiskUse=True)))
+
+match_stage = build_match_stage(year_range, selected_genres, rating_filter)
+
+# Hashable, order-independent cache key for the filter-dependent queries
+filter_key = (year_range, tuple(sorted(selected_genres)), rating_filter)
+
+try:
+    df_years, df_genres = fetch_filtered_stats(*filter_key)
+    stats_error = None
+except Exception as e:
+    df_years = df_genres = pd.DataFrame()
+    stats_error = e
 
 # ==============================
 # 📈 Rating Trend Over Time
 # ==============================
 st.subheader("📉 Average Rating Trend by Release Year")
 
+@st.cache_data(ttl=600, show_spinner=False)
+def build_trend_fig(df_years):
+    """Build and cache the rating trend figure for a given year frame"""
+    fig_trend = px.line(
+        df_years,
+        x="Year",
+        y="avgRating",
+        hover_data={"movieCount": True},
+        markers=True,
+        title="Average IMDb Rating Trend",
+        labels={"avgRating": "Average Rating"}
+    )
+    fig_trend.update_traces(
+        hovertemplate="Rating %{y:.2f}<br>Movies %{customdata[0]}<extra></extra>"
+    )
+    fig_trend.update_layout(
+        hovermode="x unified",
+        yaxis_range=[0, 10],
+        height=400
+    )
+    return fig_trend
+
 try:
-    pipeline = [
-        {"$match": {**match_stage}},
-        {"$group": {
-            "_id": "$year",
-            "avgRating": {"$avg": "$imdb.rating"},
-            "movieCount": {"$sum": 1}
-        }},
-        {"$sort": {"_id": 1}}
-    ]
-    
-    df_years = pd.DataFrame(list(db.movies.aggregate(pipeline)))
+    if stats_error:
+        raise stats_error
     
     if not df_years.empty:
         df_years.rename(columns={"_id": "Year"}, inplace=True)
         
-        fig_trend = px.line(
-            df_years,
-            x="Year",
-            y="avgRating",
-            hover_data={"movieCount": True},
-            markers=True,
-            title="Average IMDb Rating Trend",
-            labels={"avgRating": "Average Rating"}
-        )
-        fig_trend.update_layout(
-            hovermode="x unified",
-            yaxis_range=[0, 10],
-            height=400
-        )
-        st.plotly_chart(fig_trend, use_container_width=True)
+        st.plotly_chart(build_trend_fig(df_years), use_container_width=True)
     else:
         st.info("No data available for the selected filters.")
 except Exception as e:
@@ -199,22 +376,12 @@ st.divider()
 st.subheader("🎭 Genre Performance Analysis")
 
 try:
-    pipeline = [
-        {"$match": match_stage},
-        {"$unwind": "$genres"},
-        {"$group": {
-            "_id": "$genres",
-            "avgRating": {"$avg": "$imdb.rating"},
-            "movieCount": {"$sum": 1}
-        }},
-        {"$match": {"_id": {"$ne": None}}},
-        {"$sort": {"movieCount": -1}}
-    ]
-    
-    df_genres = pd.DataFrame(list(db.movies.aggregate(pipeline)))
+    if stats_error:
+        raise stats_error
     
     if not df_genres.empty:
         df_genres.rename(columns={"_id": "Genre"}, inplace=True)
+        top_genres = df_genres.head(15)
         
         # Show metrics table
         col1, col2 = st.columns(2)
@@ -222,35 +389,29 @@ try:
         with col1:
             st.write("**Genre Statistics Table**")
             st.dataframe(
-                df_genres.head(15).sort_values("movieCount", ascending=False),
+                top_genres,
                 use_container_width=True,
                 hide_index=True
             )
         
         with col2:
             # Top genres by rating
-            fig_rating = px.bar(
-                df_genres.head(15).sort_values("avgRating", ascending=True),
-                y="Genre",
-                x="avgRating",
-                orientation="h",
-                title="Top Genres by Average Rating",
-                color="avgRating",
-                color_continuous_scale="Viridis"
+            chart_rating = alt.Chart(top_genres, title="Top Genres by Average Rating").mark_bar().encode(
+                x=alt.X("avgRating:Q", title="avgRating"),
+                y=alt.Y("Genre:N", sort="-x"),
+                color=alt.Color("avgRating:Q", scale=alt.Scale(scheme="viridis")),
+                tooltip=["Genre:N", alt.Tooltip("avgRating:Q", format=".2f")]
             )
-            st.plotly_chart(fig_rating, use_container_width=True)
+            st.altair_chart(chart_rating, use_container_width=True)
         
         # Movie count by genre
-        fig_count = px.bar(
-            df_genres.head(15).sort_values("movieCount", ascending=True),
-            y="Genre",
-            x="movieCount",
-            orientation="h",
-            title="Top Genres by Movie Count",
-            color="movieCount",
-            color_continuous_scale="Blues"
+        chart_count = alt.Chart(top_genres, title="Top Genres by Movie Count").mark_bar().encode(
+            x=alt.X("movieCount:Q", title="movieCount"),
+            y=alt.Y("Genre:N", sort="-x"),
+            color=alt.Color("movieCount:Q", scale=alt.Scale(scheme="blues")),
+            tooltip=["Genre:N", alt.Tooltip("movieCount:Q", format=",")]
         )
-        st.plotly_chart(fig_count, use_container_width=True)
+        st.altair_chart(chart_count, use_container_width=True)
     else:
         st.warning("No genre data available for current filters.")
 except Exception as e:
@@ -261,48 +422,34 @@ st.divider()
 # ==============================
 # 💬 Most Discussed Movies
 # ==============================
+@st.cache_data(ttl=600, show_spinner=False)
+def build_discussed_fig(df_top):
+    """Build and cache the most-discussed figure from title/comment_count rows"""
+    fig_discussed = px.bar(
+        df_top,
+        x="comment_count",
+        y="title",
+        orientation="h",
+        title="Top Movies by Comment Count",
+        labels={"comment_count": "Number of Comments", "title": "Movie Title"},
+        color="comment_count",
+        color_continuous_scale="Reds"
+    )
+    fig_discussed.update_layout(yaxis={"categoryorder": "total ascending"})
+    return fig_discussed
+
 if comments_count > 0:
     st.subheader("💬 Most Discussed Movies")
     
     try:
-        pipeline = [
-            {"$lookup": {
-                "from": "comments",
-                "localField": "_id",
-                "foreignField": "movie_id",
-                "as": "all_comments"
-            }},
-            {"$addFields": {"comment_count": {"$size": "$all_comments"}}},
-            {"$match": match_stage},
-            {"$sort": {"comment_count": -1}},
-            {"$limit": 15},
-            {"$project": {
-                "title": 1,
-                "year": 1,
-                "imdb.rating": 1,
-                "comment_count": 1,
-                "genres": 1
-            }}
-        ]
-        
-        df_discussed = pd.DataFrame(list(db.movies.aggregate(pipeline)))
+        df_discussed = fetch_discussed(*filter_key)
         
         if not df_discussed.empty:
             df_discussed.rename(columns={"imdb.rating": "IMDb Rating"}, inplace=True)
             
-            fig_discussed = px.bar(
-                df_discussed.head(10),
-                x="comment_count",
-                y="title",
-                orientation="h",
-                title="Top Movies by Comment Count",
-                labels={"comment_count": "Number of Comments", "title": "Movie Title"},
-                color="comment_count",
-                color_continuous_scale="Reds"
-            )
-            fig_discussed.update_layout(yaxis={"categoryorder": "total ascending"})
-            
-            st.plotly_chart(fig_discussed, use_container_width=True)
+            # Only hashable scalar columns go into the cache key
+            df_top = df_discussed[["title", "comment_count"]].head(10)
+            st.plotly_chart(build_discussed_fig(df_top), use_container_width=True)
             
             st.write("**Detailed Comments Table**")
             st.dataframe(df_discussed, use_container_width=True, hide_index=True)
@@ -316,37 +463,57 @@ st.divider()
 # ==============================
 # 🔍 Movie Search Interface
 # ==============================
-st.subheader("🔍 Quick Movie Search")
+PLOT_PREVIEW_CHARS = 160
 
-search_query = st.text_input("Search movie titles (case-insensitive)...")
-result_limit = st.slider("Number of results to display", 5, 100, 20)
+def build_title_regex(query):
+    """Escape the query so it matches literally anywhere in the title"""
+    return re.escape(query)
 
-if search_query:
-    try:
-        cursor = db.movies.find(
-            {
-                "title": {"$regex": search_query, "$options": "i"},
-                **match_stage
-            },
-            {"title": 1, "year": 1, "genres": 1, "imdb.rating": 1, "plot": 1}
-        ).limit(result_limit)
-        
-        df_search = pd.DataFrame(list(cursor))
-        
-        if not df_search.empty:
-            df_search.rename(columns={"imdb.rating": "IMDb Rating"}, inplace=True)
-            display_cols = [col for col in ["title", "year", "genres", "IMDb Rating", "plot"] if col in df_search.columns]
+@st.fragment
+def search_panel(db, match_stage):
+    """Render the search form; submitting it reruns only this fragment"""
+    st.subheader("🔍 Quick Movie Search")
+    
+    with st.form("search"):
+        search_query = st.text_input("Search movie titles (case-insensitive)...")
+        result_limit = st.slider("Number of results to display", 5, 100, 20)
+        st.form_submit_button("Search")
+    
+    if search_query:
+        try:
+            cursor = db.movies.find(
+                {
+                    "title": {"$regex": build_title_regex(search_query), "$options": "i"},
+                    **match_stage
+                },
+                {
+                    "title": 1,
+                    "year": 1,
+                    "genres": 1,
+                    "imdb.rating": 1,
+                    # Truncate long plots server-side to keep the payload small
+                    "plot": {"$substrCP": ["$plot", 0, PLOT_PREVIEW_CHARS]}
+                }
+            ).limit(result_limit)
             
-            st.dataframe(
-                df_search[display_cols].drop(columns=["_id"], errors="ignore"),
-                use_container_width=True,
-                hide_index=True
-            )
-            st.success(f"✅ Found {len(df_search)} movies matching your search.")
-        else:
-            st.warning("❌ No movies found matching your search criteria.")
-    except Exception as e:
-        st.error(f"Search error: {e}")
+            df_search = pd.DataFrame(list(cursor))
+            
+            if not df_search.empty:
+                df_search.rename(columns={"imdb.rating": "IMDb Rating"}, inplace=True)
+                display_cols = [col for col in ["title", "year", "genres", "IMDb Rating", "plot"] if col in df_search.columns]
+                
+                st.dataframe(
+                    df_search[display_cols].drop(columns=["_id"], errors="ignore"),
+                    use_container_width=True,
+                    hide_index=True
+                )
+                st.success(f"✅ Found {len(df_search)} movies matching your search.")
+            else:
+                st.warning("❌ No movies found matching your search criteria.")
+        except Exception as e:
+            st.error(f"Search error: {e}")
+
+search_panel(db, match_stage)
 
 st.divider()
 